@@ -0,0 +1,73 @@
+"""
+Cache Helper Functions
+
+Redis helpers for caching serialized API responses.
+When REDIS_URL is not set (or Redis is unreachable) every call is a no-op / miss,
+so endpoints fall back to reading from MongoDB.
+"""
+
+import os
+from dotenv import load_dotenv
+from typing import Optional
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+redis = None
+
+redis_url = os.getenv("REDIS_URL")
+
+if redis_url:
+    redis = Redis.from_url(redis_url)
+
+# Helper functions for cached responses
+async def cache_get(key: str) -> Optional[bytes]:
+    """Get a cached value, None on miss"""
+    if redis is None:
+        return None
+    try:
+        return await redis.get(key)
+    except RedisError:
+        return None
+
+async def cache_set(key: str, value: bytes, ttl: int):
+    """Store a value that expires after ttl seconds"""
+    if redis is None:
+        return
+    try:
+        await redis.set(key, value, ex=ttl)
+    except RedisError:
+        pass
+
+async def cache_delete(*keys: str):
+    """Invalidate cached values"""
+    if redis is None:
+        return
+    try:
+        await redis.delete(*keys)
+    except RedisError:
+        pass
+
+async def cache_version(name: str) -> Optional[int]:
+    """Current version counter for a cached resource, None if Redis is unavailable"""
+    if redis is None:
+        return None
+    try:
+        return int(await redis.get(f"{name}:version") or 0)
+    except RedisError:
+        return None
+
+async def cache_bump(name: str, ttl: Optional[int] = None):
+    """Advance a resource's version counter after it changes, optionally expiring it after ttl seconds idle"""
+    if redis is None:
+        return
+    try:
+        if ttl is None:
+            await redis.incr(f"{name}:version")
+        else:
+            async with redis.pipeline() as pipe:
+                await pipe.incr(f"{name}:version").expire(f"{name}:version", ttl).execute()
+    except RedisError:
+        pass
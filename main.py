@@ -1,15 +1,87 @@
 import os
-from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException, Query
+import orjson
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from bson import ObjectId
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
 
-from database import db, create_document, get_documents
-from schemas import Barber, Service, Appointment
+from database import db, create_documents, get_documents
+from cache import cache_get, cache_set, cache_delete, cache_version, cache_bump
+from schemas import Barber, Service, AppointmentDate, AppointmentTime
 
-app = FastAPI(title="Barbershop Booking API")
+logger = logging.getLogger(__name__)
+
+
+def dumps(content) -> bytes:
+    # Mongo hands back naive UTC datetimes; orjson formats them natively.
+    # default=str covers ObjectId values.
+    return orjson.dumps(content, default=str, option=orjson.OPT_NAIVE_UTC)
+
+
+class OrjsonResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+async def ensure_indexes():
+    if db is None:
+        return
+    try:
+        await create_indexes()
+    except PyMongoError as e:
+        # An unreachable database must not keep the API down; /test reports it
+        logger.error("Index setup skipped, database unavailable: %s", e)
+
+
+async def create_indexes():
+    # Backs the availability lookup and booking conflict checks
+    await db["appointment"].create_index([("barber_id", 1), ("date", 1), ("status", 1), ("time", 1)])
+    # At most one scheduled appointment per barber slot
+    try:
+        await db["appointment"].create_index(
+            [("barber_id", 1), ("date", 1), ("time", 1)],
+            unique=True,
+            partialFilterExpression={"status": "scheduled"},
+        )
+    except OperationFailure as e:
+        # Double bookings stored before the index existed block it; keep
+        # serving (the booking upsert still checks the slot) and report them
+        dupes = await db["appointment"].aggregate([
+            {"$match": {"status": "scheduled"}},
+            {"$group": {
+                "_id": {"barber_id": "$barber_id", "date": "$date", "time": "$time"},
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1},
+            }},
+            {"$match": {"count": {"$gt": 1}}},
+        ]).to_list(length=None)
+        logger.error("Unique slot index not created: %s", e)
+        for d in dupes:
+            logger.error(
+                "Duplicate scheduled appointments for %s: %s",
+                d["_id"], ", ".join(str(i) for i in d["ids"]),
+            )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # In the background so a slow or down database doesn't delay startup
+    task = asyncio.create_task(ensure_indexes())
+    yield
+    task.cancel()
+
+
+app = FastAPI(title="Barbershop Booking API", default_response_class=OrjsonResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,106 +93,213 @@ app.add_middleware(
 
 # Helpers
 
+# Listing endpoints return the schema fields plus timestamps, leaving out
+# internal fields such as the barber's slots_cache
+TIMESTAMP_FIELDS = {"created_at": 1, "updated_at": 1}
+BARBER_FIELDS = {**{f: 1 for f in Barber.model_fields}, **TIMESTAMP_FIELDS}
+SERVICE_FIELDS = {**{f: 1 for f in Service.model_fields}, **TIMESTAMP_FIELDS}
+
+_day_adapter = TypeAdapter(AppointmentDate)
+
+# "HH:MM" label for every minute of the day
+SLOT_LABELS = tuple(f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60))
+
+LISTING_CACHE_CONTROL = "public, max-age=30"
+
+# Availability generations outlive the 30s bodies they key by a wide margin
+AVAILABILITY_GENERATION_TTL = 24 * 60 * 60
+
+# Documents fetched per cursor batch and written per response chunk
+STREAM_BATCH = 500
+
+# Barber slot schedules by id; barber documents rarely change
+_barber_cache = TTLCache(maxsize=512, ttl=60)
+
+
+@lru_cache(maxsize=4096)
 def oid(oid_str: str) -> ObjectId:
-    try:
-        return ObjectId(oid_str)
-    except Exception:
+    if not ObjectId.is_valid(oid_str):
         raise HTTPException(status_code=400, detail="Invalid id format")
+    return ObjectId(oid_str)
+
+
+def barber_slots(start_time: str, end_time: str, slot_minutes: int) -> List[str]:
+    """Every bookable slot start in a working day, stored on the barber as slots_cache"""
+    start_min = int(start_time[:-3]) * 60 + int(start_time[-2:])
+    end_min = int(end_time[:-3]) * 60 + int(end_time[-2:])
+    return [SLOT_LABELS[m] for m in range(start_min, end_min - slot_minutes + 1, slot_minutes)]
+
+
+def slots_cache_hours(start_time: str, end_time: str, slot_minutes: int) -> str:
+    # Working hours a slots_cache was built from, to spot hours edited since
+    return f"{start_time}-{end_time}/{slot_minutes}"
+
+
+def with_slots_cache(barber: Barber) -> dict:
+    data = barber.model_dump()
+    data["slots_cache"] = barber_slots(barber.start_time, barber.end_time, barber.slot_minutes)
+    data["slots_cache_hours"] = slots_cache_hours(barber.start_time, barber.end_time, barber.slot_minutes)
+    return data
+
+
+def parse_day(value: str) -> str:
+    # Query params are validated here: FastAPI drops the Annotated
+    # constraints of AppointmentDate on Query parameters
+    try:
+        return _day_adapter.validate_python(value)
+    except ValidationError:
+        raise HTTPException(422, detail="date must be a YYYY-MM-DD string")
+
+
+def availability_key(barber_id: str, date: str) -> str:
+    return f"avail:{barber_id}:{date}"
 
 
 def to_public(doc):
-    if not doc:
-        return doc
-    if "_id" in doc:
-        doc["id"] = str(doc.pop("_id"))
-    # Convert datetime to iso
-    for k, v in list(doc.items()):
-        if hasattr(v, "isoformat"):
-            doc[k] = v.isoformat()
+    # Only _id needs renaming; datetimes and ObjectIds are left to dumps
+    _id = doc.pop("_id", None)
+    if _id is not None:
+        doc["id"] = str(_id)
     return doc
 
 
 # Seed endpoint to insert some default barbers and services if empty
 @app.post("/seed")
-def seed_data():
+async def seed_data():
     if db is None:
         raise HTTPException(500, detail="Database not configured")
 
-    if db["barber"].count_documents({}) == 0:
+    if await db["barber"].count_documents({}, limit=1) == 0:
         barbers = [
             Barber(name="علی", specialties=["کوتاهی", "خط ریش"], phone="09120000001"),
             Barber(name="مهدی", specialties=["فید", "ریش"], phone="09120000002"),
         ]
-        for b in barbers:
-            create_document("barber", b)
+        await create_documents("barber", [with_slots_cache(b) for b in barbers])
+        _barber_cache.clear()
+        await cache_delete("barbers", "barbers:etag")
 
-    if db["service"].count_documents({}) == 0:
+    if await db["service"].count_documents({}, limit=1) == 0:
         services = [
             Service(title="کوتاهی مو", duration_minutes=30, price=200000),
             Service(title="اصلاح ریش", duration_minutes=20, price=120000),
             Service(title="پکیج کامل", duration_minutes=60, price=350000),
         ]
-        for s in services:
-            create_document("service", s)
+        await create_documents("service", services)
+        await cache_delete("services", "services:etag")
 
     return {"message": "Seeded"}
 
 
 # Public listing endpoints
+async def listing_response(request: Request, name: str, collection: str, projection: dict) -> Response:
+    """Cached listing with an ETag so clients can revalidate with If-None-Match"""
+    # The ETag is a digest of the body and is cached next to it, so a
+    # revalidation can return 304 without reading the body or Mongo, and any
+    # change made in Mongo shows up as a new ETag once the body is refilled
+    headers = {"Cache-Control": LISTING_CACHE_CONTROL}
+    cached_etag = await cache_get(f"{name}:etag")
+    if cached_etag is not None:
+        headers["ETag"] = cached_etag.decode()
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        body = await cache_get(name)
+    else:
+        body = None
+
+    if body is None:
+        items = await get_documents(collection, projection=projection)
+        body = dumps([to_public(d) for d in items])
+        headers["ETag"] = f'W/"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        await cache_set(name, body, 300)
+        await cache_set(f"{name}:etag", headers["ETag"].encode(), 300)
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/barbers")
-def list_barbers():
-    items = get_documents("barber")
-    return [to_public(d) for d in items]
+async def list_barbers(request: Request):
+    return await listing_response(request, "barbers", "barber", BARBER_FIELDS)
 
 
 @app.get("/services")
-def list_services():
-    items = get_documents("service")
-    return [to_public(d) for d in items]
+async def list_services(request: Request):
+    return await listing_response(request, "services", "service", SERVICE_FIELDS)
 
 
 # Availability calculation
-class AvailabilityResponse(BaseModel):
-    date: str
-    slots: List[str]
-
-
-def time_range(start: datetime, end: datetime, step_min: int):
-    t = start
-    while t + timedelta(minutes=step_min) <= end:
-        yield t
-        t += timedelta(minutes=step_min)
+async def fetch_barber_with_bookings(barber_id: str, date: str):
+    """Barber slot schedule plus that day's booked times in one round-trip"""
+    pipeline = [
+        {"$match": {"_id": oid(barber_id)}},
+        {"$lookup": {
+            "from": "appointment",
+            "let": {"bid": {"$toString": "$_id"}},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$barber_id", "$$bid"]},
+                    {"$eq": ["$date", date]},
+                    {"$eq": ["$status", "scheduled"]},
+                ]}}},
+                {"$project": {"time": 1, "_id": 0}},
+            ],
+            "as": "taken",
+        }},
+        {"$project": {"start_time": 1, "end_time": 1, "slot_minutes": 1, "slots_cache": 1, "slots_cache_hours": 1, "taken": "$taken.time"}},
+    ]
+    docs = await db["barber"].aggregate(pipeline).to_list(length=1)
+    if not docs:
+        raise HTTPException(404, detail="Barber not found")
+    bdoc = docs[0]
+    return bdoc, bdoc.pop("taken")
 
 
-@app.get("/availability", response_model=AvailabilityResponse)
-def availability(
+@app.get("/availability")
+async def availability(
     barber_id: str = Query(...),
     date: str = Query(..., description="YYYY-MM-DD"),
 ):
-    bdoc = db["barber"].find_one({"_id": oid(barber_id)})
-    if not bdoc:
-        raise HTTPException(404, detail="Barber not found")
-
-    # Working hours
-    start_h, start_m = map(int, bdoc.get("start_time", "09:00").split(":"))
-    end_h, end_m = map(int, bdoc.get("end_time", "20:00").split(":"))
-    slot_min = int(bdoc.get("slot_minutes", 30))
-
-    day = datetime.strptime(date, "%Y-%m-%d")
-    start_dt = day.replace(hour=start_h, minute=start_m, second=0, microsecond=0)
-    end_dt = day.replace(hour=end_h, minute=end_m, second=0, microsecond=0)
-
-    # Fetch existing appointments for the day
-    apps = list(db["appointment"].find({"barber_id": barber_id, "date": date, "status": "scheduled"}))
-    taken_times = set(a["time"] for a in apps)
-
-    slots = []
-    for t in time_range(start_dt, end_dt, slot_min):
-        st = t.strftime("%H:%M")
-        if st not in taken_times:
-            slots.append(st)
-
-    return AvailabilityResponse(date=date, slots=slots)
+    day = parse_day(date)
+    # Read the generation before Mongo: a booking landing mid-request bumps
+    # it, so this response is cached under a key that is never read again
+    name = availability_key(barber_id, day)
+    generation = await cache_version(name)
+    key = f"{name}:{generation}"
+    if generation is not None:
+        body = await cache_get(key)
+        if body is not None:
+            return Response(content=body, media_type="application/json")
+
+    day_slots = _barber_cache.get(barber_id)
+    if day_slots is not None:
+        # Schedule is cached, only the day's booked times are needed;
+        # the projection is covered by the appointment slot index
+        apps = await db["appointment"].find(
+            {"barber_id": barber_id, "date": day, "status": "scheduled"},
+            {"time": 1, "_id": 0},
+        ).to_list(length=None)
+        taken_times = [a["time"] for a in apps]
+    else:
+        bdoc, taken_times = await fetch_barber_with_bookings(barber_id, day)
+        hours = (bdoc.get("start_time", "09:00"), bdoc.get("end_time", "20:00"), int(bdoc.get("slot_minutes", 30)))
+        day_slots = bdoc.get("slots_cache")
+        if day_slots is None or bdoc.get("slots_cache_hours") != slots_cache_hours(*hours):
+            # Barbers stored before slots_cache existed, or whose hours were
+            # edited since: rebuild once and write it back
+            day_slots = barber_slots(*hours)
+            await db["barber"].update_one(
+                {"_id": bdoc["_id"]},
+                {"$set": {"slots_cache": day_slots, "slots_cache_hours": slots_cache_hours(*hours)}},
+            )
+        _barber_cache[barber_id] = day_slots
+
+    taken = set(taken_times)
+    slots = [st for st in day_slots if st not in taken]
+
+    body = dumps({"date": day, "slots": slots})
+    if generation is not None:
+        await cache_set(key, body, 30)
+    return Response(content=body, media_type="application/json")
 
 
 # Booking endpoint
@@ -129,61 +308,93 @@ class CreateAppointment(BaseModel):
     service_id: str
     customer_name: str
     customer_phone: str
-    date: str
-    time: str
+    date: AppointmentDate
+    time: AppointmentTime
     notes: Optional[str] = None
 
 
 @app.post("/appointments")
-def create_appointment(payload: CreateAppointment):
-    # Validate barber and service exist
-    if not db["barber"].find_one({"_id": oid(payload.barber_id)}):
+async def create_appointment(payload: CreateAppointment):
+    # Validate barber and service exist, both lookups in flight together
+    bdoc, sdoc = await asyncio.gather(
+        db["barber"].find_one({"_id": oid(payload.barber_id)}, {"_id": 1}),
+        db["service"].find_one({"_id": oid(payload.service_id)}, {"_id": 1}),
+    )
+    if not bdoc:
         raise HTTPException(404, detail="Barber not found")
-    sdoc = db["service"].find_one({"_id": oid(payload.service_id)})
     if not sdoc:
         raise HTTPException(404, detail="Service not found")
 
-    # Ensure slot free
-    exists = db["appointment"].find_one({
-        "barber_id": payload.barber_id,
-        "date": payload.date,
-        "time": payload.time,
-        "status": "scheduled",
-    })
-    if exists:
+    # Reserve the slot atomically: insert only if no scheduled appointment
+    # matches, with the unique slot index catching concurrent upserts
+    doc = payload.model_dump()
+    slot = {k: doc.pop(k) for k in ("barber_id", "date", "time")}
+    slot["status"] = "scheduled"
+    now = datetime.now(timezone.utc)
+    try:
+        res = await db["appointment"].update_one(
+            slot,
+            {"$setOnInsert": {**doc, "created_at": now, "updated_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        res = None
+    if res is None or res.upserted_id is None:
         raise HTTPException(409, detail="این زمان قبلا رزرو شده است")
+    await cache_bump(availability_key(slot["barber_id"], slot["date"]), AVAILABILITY_GENERATION_TTL)
+    return {"id": str(res.upserted_id), "message": "نوبت با موفقیت ثبت شد"}
+
 
-    appo = Appointment(**payload.model_dump(), status="scheduled")
-    new_id = create_document("appointment", appo)
-    return {"id": new_id, "message": "نوبت با موفقیت ثبت شد"}
+async def stream_json_array(first: list, cursor):
+    """Encode an already fetched first batch plus the rest of the cursor as one JSON array"""
+    yield b"[" + b",".join(dumps(to_public(doc)) for doc in first)
+    batch = []
+    async for doc in cursor:
+        batch.append(dumps(to_public(doc)))
+        if len(batch) == STREAM_BATCH:
+            yield b"," + b",".join(batch)
+            batch = []
+    if batch:
+        yield b"," + b",".join(batch)
+    yield b"]"
 
 
 @app.get("/appointments")
-def list_appointments(barber_id: Optional[str] = None, date: Optional[str] = None):
+async def list_appointments(barber_id: Optional[str] = None, date: Optional[str] = None):
     q = {}
     if barber_id:
         q["barber_id"] = barber_id
     if date:
-        q["date"] = date
-    docs = list(db["appointment"].find(q).sort("created_at", -1))
-    return [to_public(d) for d in docs]
+        q["date"] = parse_day(date)
+    cursor = db["appointment"].find(q).sort("created_at", -1).batch_size(STREAM_BATCH)
+    # Run the query before the 200 goes out, so connection and query errors
+    # still surface as a 500 instead of a truncated body
+    first = await cursor.to_list(length=STREAM_BATCH)
+    if len(first) < STREAM_BATCH:
+        return Response(content=dumps([to_public(d) for d in first]), media_type="application/json")
+    return StreamingResponse(stream_json_array(first, cursor), media_type="application/json")
 
 
 @app.delete("/appointments/{appointment_id}")
-def cancel_appointment(appointment_id: str):
-    res = db["appointment"].update_one({"_id": oid(appointment_id)}, {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}})
-    if res.matched_count == 0:
+async def cancel_appointment(appointment_id: str):
+    doc = await db["appointment"].find_one_and_update(
+        {"_id": oid(appointment_id)},
+        {"$set": {"status": "cancelled", "updated_at": datetime.now(timezone.utc)}},
+        projection={"barber_id": 1, "date": 1},
+    )
+    if doc is None:
         raise HTTPException(404, detail="Appointment not found")
+    await cache_bump(availability_key(doc["barber_id"], doc["date"]), AVAILABILITY_GENERATION_TTL)
     return {"message": "نوبت لغو شد"}
 
 
 @app.get("/")
-def root():
+async def root():
     return {"name": "Barbershop API", "endpoints": ["/barbers", "/services", "/availability", "/appointments"]}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -191,7 +402,7 @@ def test_database():
     try:
         if db is not None:
             response["database"] = "✅ Connected"
-            response["collections"] = db.list_collection_names()
+            response["collections"] = await db.list_collection_names()
         else:
             response["database"] = "❌ Not Configured"
     except Exception as e:
@@ -202,4 +413,14 @@ def test_database():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # For production, gunicorn -k uvicorn.workers.UvicornWorker -w N works the same way
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        proxy_headers=True,
+    )
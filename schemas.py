@@ -5,8 +5,14 @@ Each Pydantic model represents a MongoDB collection.
 Collection name is the lowercase of the class name.
 """
 
-from pydantic import BaseModel, Field
-from typing import Optional, List, Literal
+from pydantic import BaseModel, Field, StringConstraints
+from typing import Annotated, Optional, List, Literal
+
+# Appointment day and start time as stored: range-checked YYYY-MM-DD / HH:MM
+# strings, matched by pydantic-core's native regex engine. Seconds, UTC
+# offsets, datetimes and ints are all rejected rather than normalised.
+AppointmentDate = Annotated[str, StringConstraints(pattern=r"^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])$")]
+AppointmentTime = Annotated[str, StringConstraints(pattern=r"^([01][0-9]|2[0-3]):[0-5][0-9]$")]
 
 class Barber(BaseModel):
     """
@@ -46,7 +52,7 @@ class Appointment(BaseModel):
     service_id: str = Field(..., description="Service document id as string")
     customer_name: str
     customer_phone: str
-    date: str = Field(..., pattern=r"^\d{4}-\d{2}-\d{2}$", description="YYYY-MM-DD")
-    time: str = Field(..., pattern=r"^\d{2}:\d{2}$", description="HH:MM 24h start time")
+    date: AppointmentDate = Field(..., description="YYYY-MM-DD")
+    time: AppointmentTime = Field(..., description="HH:MM 24h start time")
     status: Literal["scheduled", "cancelled"] = Field("scheduled")
     notes: Optional[str] = None